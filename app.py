@@ -3,7 +3,7 @@ import datetime
 import logging
 import os
 import uuid
-from typing import List, Coroutine, Any
+from typing import List, Optional, FrozenSet, Tuple, Type
 
 from telethon import TelegramClient
 from telethon.tl import custom, types
@@ -12,6 +12,33 @@ import config
 import repository
 
 
+def _make_file_id(channel_id: int, msg: custom.message.Message, media) -> str:
+    """
+    Creates a unique identifier for a file based on channel, message, and media IDs.
+
+    :param channel_id: The ID of the channel the message belongs to.
+    :param msg: The Telegram message object containing the file.
+    :param media: video or audio from the message.
+    :return: A string representing the unique file identifier in the format 'channel_id.message_id.media_id'.
+    """
+    return f"{channel_id}.{msg.id}.{getattr(media, 'id', 'unknown')}"
+
+
+def _message_contains_all_keywords(msg: custom.message.Message, required_keywords: Optional[FrozenSet[str]]) -> bool:
+    """
+    Checks if the message text contains all specified keywords.
+
+    :param msg: The Telegram message to check for keywords.
+    :param required_keywords: The casefolded keywords to look for, None to accept any message.
+    :return: True if all specified keywords are present in the message text, False otherwise.
+    """
+    if required_keywords is None:
+        return True
+    if not msg.text:
+        return False
+    return required_keywords <= set(msg.text.casefold().split())
+
+
 class DownloadFilesApp:
     """
     Service to download files from TG restricted channels.
@@ -21,6 +48,11 @@ class DownloadFilesApp:
         self._repo = repo
         self._cfg = cfg
         self._log = log
+        # Config is immutable, so keywords are casefolded once instead of for every scanned message.
+        self._required_keywords = frozenset(w.casefold() for w in (cfg.search.key_words or ())) or None
+        # Download directories are resolved once, so stored file paths need no abspath per file.
+        self._video_dir_abs = os.path.abspath(cfg.storage.video_dir)
+        self._audio_dir_abs = os.path.abspath(cfg.storage.audio_dir)
         self._client = TelegramClient(
             self._cfg.user.session_file,
             self._cfg.user.api_id,
@@ -39,55 +71,34 @@ class DownloadFilesApp:
         if default_extension.startswith('.'):
             raise ValueError("extension with leading point")
 
-        original_filename = None
-        for attr in obj.attributes:
-            if hasattr(attr, 'file_name'):
-                original_filename = attr.file_name
-                break
-
+        original_filename = next(
+            (attr.file_name for attr in obj.attributes if isinstance(attr, types.DocumentAttributeFilename)),
+            None,
+        )
         if not original_filename:
             return default_extension
 
-        _, extension = os.path.splitext(original_filename)
-        if not extension:
+        # The extension is searched for in the last path component only. A leading dot marks a hidden file
+        # rather than an extension; a trailing dot gives no extension.
+        start = max(original_filename.rfind('/'), original_filename.rfind(os.sep)) + 1
+        dot = original_filename.rfind('.', start)
+        if dot <= start or dot == len(original_filename) - 1:
             return default_extension
-        if extension.startswith('.'):
-            return extension[1:]
-
-        return extension
-
-    def _make_video_id(self, msg: custom.message.Message) -> str:
-        """
-        Creates a unique identifier for a video based on channel, message, and video IDs.
 
-        :param msg: The Telegram message object containing the video.
-        :return: A string representing the unique video identifier in the format 'channel_id.message_id.video_id'.
-        """
-        return f"{self._cfg.search.channel_id}.{msg.id}.{getattr(msg.video, 'id', 'unknown')}"
-
-    def _make_audio_id(self, msg: custom.message.Message) -> str:
-        """
-        Creates a unique identifier for an audio based on channel, message, and audio IDs.
-
-        :param msg: The Telegram message object containing the audio.
-        :return: A string representing the unique audio identifier in the format 'channel_id.message_id.audio_id'.
-        """
-        return f"{self._cfg.search.channel_id}.{msg.id}.{getattr(msg.audio, 'id', 'unknown')}"
+        return original_filename[dot + 1:]
 
-    def _message_contains_all_keywords(self, msg: custom.message.Message) -> bool:
+    async def _download_media(self, message: custom.message.Message, out_file: str) -> None:
         """
-        Checks if the message text contains all specified keywords.
+        Streams the media of the message to a file, writing each chunk in a worker thread so that disk writes
+        do not block the event loop shared by concurrent downloads.
 
-        :param msg: The Telegram message to check for keywords.
-        :return: True if all specified keywords are present in the message text, False otherwise.
+        :param message: The Telegram message containing the file to download.
+        :param out_file: Path of the file to write.
+        :return:
         """
-        if not self._cfg.search.key_words:
-            return True
-        if not msg.text:
-            return False
-        words_in_message = set(msg.text.lower().split())
-        required_keywords = {w.lower() for w in self._cfg.search.key_words}
-        return required_keywords.issubset(words_in_message)
+        with open(out_file, 'wb') as file:
+            async for chunk in self._client.iter_download(message.media, file_size=message.file.size):
+                await asyncio.to_thread(file.write, chunk)
 
     async def _download_and_process_file(
             self,
@@ -99,46 +110,52 @@ class DownloadFilesApp:
             directory: str,
     ) -> bool:
         """
-        Acquires the semaphore, downloads a single file from the provided message, writes metadata to the repository, and releases the semaphore.
+        Downloads a single file from the provided message, buffers its metadata for writing to the repository, and releases the semaphore.
 
         :param message: The Telegram message containing the file to download.
         :param channel: The Telegram channel object from which the message was retrieved.
-        :param semaphore: An asyncio.Semaphore to limit concurrent downloads.
+        :param semaphore: An asyncio.Semaphore to limit concurrent downloads, already acquired by the caller.
         :param extension: a file extension.
         :param file_id: a file id.
-        :param directory: a file id.
+        :param directory: an absolute path of the directory to save the file to.
         :return: True if the file was downloaded and processed successfully, False otherwise.
         """
         out_file = os.path.join(directory, f"{file_id}.{extension}")
+        # The file is downloaded under a temporary name and renamed once complete,
+        # so an interrupted download never leaves a truncated file under the final name.
+        part_file = f"{out_file}.part"
 
-        async with semaphore:
+        try:
             try:
-                self._log.info(f"Starting download for file {file_id} from message {message.id}")
+                self._log.info("Starting download for file %s from message %s", file_id, message.id)
 
-                await self._client.download_media(message.media, out_file)
+                await self._download_media(message, part_file)
+                os.replace(part_file, out_file)
 
-                self._log.info(f"Finished downloading file {file_id}. Writing to repository...")
+                self._log.info("Finished downloading file %s. Buffering metadata for the repository...", file_id)
 
                 file_record = repository.DownloadedFile(
                     id=str(uuid.uuid4()),
                     channel_id=channel.id,
                     message_id=str(message.id),
                     text=message.text or "",
-                    filename=os.path.abspath(out_file),
+                    filename=out_file,
                     created=datetime.datetime.now(datetime.timezone.utc),
                 )
-                await self._repo.write(file_record)
-                self._log.info(f"Successfully saved metadata for file {out_file}")
+                await self._repo.write_buffered(file_record)
                 return True
 
             except Exception as e:
-                self._log.exception(f"Failed to download or process file {file_id} from message {message.id}: {e}")
-                if os.path.exists(out_file):
-                    try:
-                        os.remove(out_file)
-                    except OSError as ose:
-                        self._log.error(f"Error removing partially downloaded file {out_file}: {ose}")
+                self._log.exception("Failed to download or process file %s from message %s: %s", file_id, message.id, e)
+                try:
+                    os.remove(part_file)
+                except FileNotFoundError:
+                    pass
+                except OSError as ose:
+                    self._log.error("Error removing partially downloaded file %s: %s", part_file, ose)
                 return False
+        finally:
+            semaphore.release()
 
     async def download_and_save(self) -> None:
         """
@@ -151,77 +168,95 @@ class DownloadFilesApp:
 
         try:
             await self._repo.open_conn()
-            existing_ids = await self._repo.get_files_ids(self._cfg.search.channel_id)
-            self._log.info(f"Found {len(existing_ids)} existing file records for this channel.")
+            existing_ids = await self._repo.get_message_ids(self._cfg.search.channel_id)
+            self._log.info("Found %d existing file records for this channel.", len(existing_ids))
         except Exception as e:
-            self._log.exception(f"Fatal: Could not get existing files IDs from repository. Aborting. Error: {e}")
+            self._log.exception("Fatal: Could not get downloaded message IDs from repository. Aborting. Error: %s", e)
             return
 
         semaphore = asyncio.Semaphore(self._cfg.app.download_at_same_time_size)
-        tasks: List[Coroutine[Any, Any, bool]] = []
+
+        # (message attribute, server-side message filter, default file extension, download directory)
+        # for every media type to download.
+        media_kinds: List[Tuple[str, Type[types.TypeMessagesFilter], str, str]] = []
+        if self._cfg.app.download_video:
+            media_kinds.append(('video', types.InputMessagesFilterVideo, 'mp4', self._video_dir_abs))
+        if self._cfg.app.download_audio:
+            media_kinds.append(('audio', types.InputMessagesFilterMusic, 'mp3', self._audio_dir_abs))
 
         async with self._client:
             self._log.info("Telegram client started and connected.")
 
             try:
-                self._log.info(f"Connecting to channel: '{self._cfg.search.channel_id}'")
+                self._log.info("Connecting to channel: '%s'", self._cfg.search.channel_id)
                 channel = await self._client.get_entity(self._cfg.search.channel_id)
-                self._log.info(f"Successfully connected to channel '{getattr(channel, 'title', 'N/A')}'")
+                self._log.info("Successfully connected to channel '%s'", getattr(channel, 'title', 'N/A'))
             except Exception as e:
-                self._log.exception(f"Fatal: Could not connect to channel '{self._cfg.search.channel_id}'. Aborting. Error: {e}")
+                self._log.exception(
+                    "Fatal: Could not connect to channel '%s'. Aborting. Error: %s", self._cfg.search.channel_id, e)
                 return
 
-            self._log.info("Scanning for new files...")
-            try:
-                async for message in self._client.iter_messages(channel):
-                    if self._cfg.app.download_video:
-                        if not message.video or not self._message_contains_all_keywords(message):
-                            continue
-
-                        video_id = self._make_video_id(message)
-                        if video_id in existing_ids:
-                            continue
-
-                        self._log.debug(f"Found new video to download: {video_id}")
-                        task = self._download_and_process_file(
-                            message,
-                            channel,
-                            semaphore,
-                            DownloadFilesApp._extract_file_extension_or_get_default(message.video, 'mp4'),
-                            video_id,
-                            self._cfg.storage.video_dir,
-                        )
-                        tasks.append(task)
-
-                    if self._cfg.app.download_audio:
-                        if not message.audio or not self._message_contains_all_keywords(message):
-                            continue
-
-                        audio_id = self._make_audio_id(message)
-                        if audio_id in existing_ids:
-                            continue
-
-                        self._log.debug(f"Found new audio to download: {audio_id}")
-                        task = self._download_and_process_file(
-                            message,
-                            channel,
-                            semaphore,
-                            DownloadFilesApp._extract_file_extension_or_get_default(message.audio, 'mp3'),
-                            audio_id,
-                            self._cfg.storage.audio_dir
-                        )
-                        tasks.append(task)
-
-            except Exception as e:
-                self._log.exception(f"An error occurred while iterating messages in channel '{self._cfg.search.channel_id}': {e}")
-
-            if not tasks:
+            found_count = 0
+            download_count = 0
+
+            def count_download(task: asyncio.Task) -> None:
+                nonlocal download_count
+                if not task.cancelled() and task.result():
+                    download_count += 1
+
+            # Bind everything the per-message loop needs to locals to avoid repeated attribute lookups.
+            channel_id = self._cfg.search.channel_id
+            required_keywords = self._required_keywords
+            extract_extension = DownloadFilesApp._extract_file_extension_or_get_default
+            download_file = self._download_and_process_file
+
+            # Downloads start as soon as they are found. The semaphore is acquired before a task is created,
+            # so scanning pauses while the maximum number of downloads is running and pending tasks stay bounded.
+            async with asyncio.TaskGroup() as task_group:
+                for kind, message_filter, default_extension, directory in media_kinds:
+                    self._log.info("Scanning for new %s files...", kind)
+                    try:
+                        async for message in self._client.iter_messages(channel, filter=message_filter):
+                            if message.id in existing_ids or not _message_contains_all_keywords(
+                                    message, required_keywords):
+                                continue
+
+                            media = getattr(message, kind)
+                            # The server filter may still return a message without such media, e.g. an expired one.
+                            if media is None:
+                                continue
+                            file_id = _make_file_id(channel_id, message, media)
+                            extension = extract_extension(media, default_extension)
+                            self._log.debug("Found new %s to download: %s", kind, file_id)
+                            await semaphore.acquire()
+                            task = task_group.create_task(download_file(
+                                message,
+                                channel,
+                                semaphore,
+                                extension,
+                                file_id,
+                                directory,
+                            ))
+                            task.add_done_callback(count_download)
+                            found_count += 1
+
+                    except Exception as e:
+                        self._log.exception(
+                            "An error occurred while iterating %s messages in channel '%s': %s",
+                            kind, self._cfg.search.channel_id, e)
+
+                if found_count:
+                    self._log.info(
+                        "Found %d new files. Waiting for downloads to finish (up to %d at a time)...",
+                        found_count, self._cfg.app.download_at_same_time_size)
+
+            if not found_count:
                 self._log.info("No new files found to download.")
             else:
-                self._log.info(
-                    f"Found {len(tasks)} new files. Starting concurrent download (up to {self._cfg.app.download_at_same_time_size} at a time)...")
-                results = await asyncio.gather(*tasks)
-                download_count = sum(1 for res in results if res)
-                self._log.info(f"Finished download session. Successfully downloaded {download_count} new files.")
+                try:
+                    await self._repo.flush()
+                except Exception as e:
+                    self._log.exception("Failed to save metadata of downloaded files: %s", e)
+                self._log.info("Finished download session. Successfully downloaded %d new files.", download_count)
 
         self._log.info("Process finished. Client has disconnected.")
@@ -1,8 +1,15 @@
+import os
 import typing as tp
 
 import pydantic
 import yaml
 
+try:
+    # libyaml-based loader, much faster than the pure Python one.
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
 
 class User(pydantic.BaseModel):
     """
@@ -18,7 +25,7 @@ class App(pydantic.BaseModel):
     """
     Configuration for running the app.
     """
-    download_at_same_time_size: int
+    download_at_same_time_size: int = 50
     log_file: str
     download_video: bool
     download_audio: bool
@@ -57,7 +64,54 @@ class Config(pydantic.BaseModel):
        :param filename: Path to the YAML configuration file.
        :return: An instance of the Config class populated with the YAML data.
        """
-        with open(filename) as file:
-            data = yaml.safe_load(file)
+        # Opened in binary mode so that libyaml decodes the bytes itself instead of Python decoding them first.
+        with open(filename, 'rb') as file:
+            data = yaml.load(file, Loader=_YamlLoader)
             cfg = Config(**data)
         return cfg
+
+    @staticmethod
+    def load_from_yaml_cached(filename: str) -> 'Config':
+        """
+        Load configuration from a YAML file, reusing a JSON cache stored next to it.
+
+        The cache '<filename>.cache.json' is used when the size and modification time of the YAML file recorded in it
+        match the current ones and is rewritten otherwise. Any problem with the cache falls back to parsing the YAML file.
+        :param filename: Path to the YAML configuration file.
+        :return: An instance of the Config class populated with the YAML data.
+        """
+        cache_filename = f"{filename}.cache.json"
+        yaml_stat = os.stat(filename)
+        try:
+            with open(cache_filename, 'rb') as file:
+                cache = _ConfigCache.model_validate_json(file.read())
+            if cache.yaml_size == yaml_stat.st_size and cache.yaml_mtime_ns == yaml_stat.st_mtime_ns:
+                return cache.config
+        except (OSError, pydantic.ValidationError):
+            pass
+
+        cfg = Config.load_from_yaml(filename)
+        cache = _ConfigCache(yaml_size=yaml_stat.st_size, yaml_mtime_ns=yaml_stat.st_mtime_ns, config=cfg)
+        # The cache holds the API credentials, so it is readable by the owner only. It is written to a temporary
+        # file first and renamed, so a concurrent run never reads a partially written cache.
+        tmp_filename = f"{cache_filename}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with open(fd, 'w') as file:
+                file.write(cache.model_dump_json())
+            os.replace(tmp_filename, cache_filename)
+        except OSError:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+        return cfg
+
+
+class _ConfigCache(pydantic.BaseModel):
+    """
+    Parsed configuration cached together with the size and modification time of the YAML file it was parsed from.
+    """
+    yaml_size: int
+    yaml_mtime_ns: int
+    config: Config
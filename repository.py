@@ -1,11 +1,15 @@
 import asyncio
+import concurrent.futures
 import dataclasses
 import datetime
 import logging
-import os
 import sqlite3
 import typing as tp
 
+# Buffered records are written to the database in batches of this size or at least this often.
+_WRITE_BATCH_SIZE = 500
+_WRITE_INTERVAL_SEC = 2.0
+
 
 @dataclasses.dataclass
 class DownloadedFile:
@@ -20,6 +24,42 @@ class DownloadedFile:
     created: datetime.datetime
 
 
+class MessageIdBitmap:
+    """
+    A set of message IDs stored as a bitmap with one bit per ID up to the greatest one.
+
+    Message IDs in a channel are sequential, so this takes a fraction of the memory of a set of ints.
+    """
+
+    def __init__(self, max_id: int):
+        """
+        Initializes an empty bitmap.
+
+        :param max_id: The greatest message ID that will be added.
+        """
+        self._bits = bytearray(max_id // 8 + 1)
+        self._len = 0
+
+    def add(self, message_id: int) -> None:
+        """
+        Adds a message ID to the bitmap.
+
+        :param message_id: A message ID not greater than max_id.
+        :return:
+        """
+        index, mask = message_id >> 3, 1 << (message_id & 7)
+        if not self._bits[index] & mask:
+            self._bits[index] |= mask
+            self._len += 1
+
+    def __contains__(self, message_id: int) -> bool:
+        index = message_id >> 3
+        return 0 <= index < len(self._bits) and bool(self._bits[index] & (1 << (message_id & 7)))
+
+    def __len__(self) -> int:
+        return self._len
+
+
 class SqliteFileDownloadHistoryRepository:
     """
     An asynchronous repository for storing file download history in an SQLite database.
@@ -34,9 +74,29 @@ class SqliteFileDownloadHistoryRepository:
         """
         self._filename = filename
         self._conn: tp.Optional[sqlite3.Connection] = None
+        # All database work runs in one dedicated thread instead of the shared default executor.
+        self._executor: tp.Optional[concurrent.futures.ThreadPoolExecutor] = None
         self._lock = asyncio.Lock()  # Lock to ensure thread-safe connection handling.
+        self._pending: tp.List[DownloadedFile] = []  # Records buffered by write_buffered.
+        self._flush_task: tp.Optional[asyncio.Task] = None
         self._log = logging.getLogger(__name__)
 
+    def _open_connection(self) -> sqlite3.Connection:
+        """
+        Opens a synchronous connection to the SQLite database with the performance settings applied.
+
+        :return: sqlite3.Connection - An open SQLite database connection.
+        """
+        conn = sqlite3.connect(self._filename, check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        # WAL with synchronous=NORMAL does not fsync on every commit, which is enough for a download history.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-65536")
+        return conn
+
     def _connect_and_init_db(self) -> sqlite3.Connection:
         """
         Establishes a synchronous connection to the SQLite database and initializes the schema if it does not exist.
@@ -45,9 +105,8 @@ class SqliteFileDownloadHistoryRepository:
 
         :return: sqlite3.Connection - An open SQLite database connection with the required schema initialized.
         """
-        self._log.info(f"Connecting to database at {self._filename}")
-        conn = sqlite3.connect(self._filename, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
+        self._log.info("Connecting to database at %s", self._filename)
+        conn = self._open_connection()
 
         cursor = conn.cursor()
         # table name is downloaded_videos for backward capability
@@ -63,11 +122,22 @@ class SqliteFileDownloadHistoryRepository:
             )
             """
         )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_channel_message ON downloaded_videos(channel_id, message_id)")
         conn.commit()
         cursor.close()
         self._log.info("Database connection and schema initialization complete.")
         return conn
 
+    async def _run(self, func: tp.Callable[..., tp.Any], *args: tp.Any) -> tp.Any:
+        """
+        Runs a synchronous worker in the dedicated database thread.
+
+        :param func: The synchronous worker to run.
+        :param args: Positional arguments for the worker.
+        :return: The value returned by the worker.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
     async def _get_connection(self) -> sqlite3.Connection:
         """
         Asynchronously gets or creates a database connection.
@@ -78,7 +148,9 @@ class SqliteFileDownloadHistoryRepository:
         """
         async with self._lock:
             if self._conn is None:
-                self._conn = await asyncio.to_thread(self._connect_and_init_db)
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+                self._conn = await self._run(self._connect_and_init_db)
             return self._conn
 
     async def open_conn(self) -> None:
@@ -96,10 +168,32 @@ class SqliteFileDownloadHistoryRepository:
         :return:
         """
         async with self._lock:
-            if self._conn is not None:
-                self._log.info("Closing database connection.")
-                await asyncio.to_thread(self._conn.close)
+            try:
+                if self._conn is not None:
+                    self._log.info("Closing database connection.")
+                    await self._run(self._close_sync, self._conn)
+            finally:
                 self._conn = None
+                # The executor also exists without a connection when connecting failed.
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+
+    @staticmethod
+    def _close_sync(conn: sqlite3.Connection) -> None:
+        """
+        Synchronous worker for closing the connection.
+
+        Runs PRAGMA optimize first, as SQLite recommends for long-lived connections, so query planner
+        statistics stay current for the next run.
+
+        :param conn: The SQLite database connection.
+        :return:
+        """
+        try:
+            conn.execute("PRAGMA optimize")
+        finally:
+            conn.close()
 
     def _write_sync(self, conn: sqlite3.Connection, v: DownloadedFile) -> None:
         """
@@ -109,16 +203,18 @@ class SqliteFileDownloadHistoryRepository:
         :param v: The DownloadedVideo object to save.
         :return:
         """
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO downloaded_videos (id, channel_id, message_id, text, filename, created)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (v.id, v.channel_id, v.message_id, v.text, v.filename, v.created.isoformat()),
-        )
+        try:
+            conn.execute(
+                """
+                INSERT INTO downloaded_videos (id, channel_id, message_id, text, filename, created)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (v.id, v.channel_id, v.message_id, v.text, v.filename, v.created.isoformat()),
+            )
+        except BaseException:
+            conn.rollback()
+            raise
         conn.commit()
-        cursor.close()
 
     async def write(self, v: DownloadedFile) -> None:
         """
@@ -128,34 +224,163 @@ class SqliteFileDownloadHistoryRepository:
         :return:
         """
         conn = await self._get_connection()
-        await asyncio.to_thread(self._write_sync, conn, v)
+        await self._run(self._write_sync, conn, v)
 
-    def _get_video_ids_sync(self, conn: sqlite3.Connection, channel_id: int) -> tp.Set[str]:
+    def _write_many_sync(self, conn: sqlite3.Connection, records: tp.List[DownloadedFile]) -> None:
         """
-        Synchronous worker for retrieving video IDs for a given channel.
+        Synchronous worker for writing several file records in a single transaction.
 
         :param conn: The SQLite database connection.
-        :param channel_id: The channel ID to query for.
-        :return: A set of unique video ID strings.
+        :param records: The DownloadedFile objects to save.
+        :return:
         """
-        cursor = conn.cursor()
-        cursor.execute("SELECT filename FROM downloaded_videos WHERE channel_id = ?", (channel_id,))
-        rows = cursor.fetchall()
-        cursor.close()
+        # IMMEDIATE takes the write lock up front instead of upgrading to it in the middle of the batch.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                """
+                INSERT INTO downloaded_videos (id, channel_id, message_id, text, filename, created)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(r.id, r.channel_id, r.message_id, r.text, r.filename, r.created.isoformat()) for r in records],
+            )
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
 
-        ids = {os.path.splitext(os.path.basename(row["filename"]))[0] for row in rows}
+    async def write_many(self, records: tp.List[DownloadedFile]) -> None:
+        """
+        Asynchronously saves several file records to the database in a single transaction.
+
+        :param records: The DownloadedFile objects to save.
+        :return:
+        """
+        conn = await self._get_connection()
+        await self._run(self._write_many_sync, conn, records)
+
+    async def write_buffered(self, v: DownloadedFile) -> None:
+        """
+        Buffers a new file record to be saved together with others in a single transaction.
+
+        The buffer is written once it holds _WRITE_BATCH_SIZE records or _WRITE_INTERVAL_SEC seconds after
+        the first buffered record, whichever comes first. Errors of these writes are logged, not raised.
+        Call flush() to write the remaining records before closing the connection.
+
+        :param v: The DownloadedFile object to save.
+        :return:
+        """
+        self._pending.append(v)
+        if len(self._pending) >= _WRITE_BATCH_SIZE:
+            await self._flush_and_log_errors()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_interval())
+
+    async def _flush_after_interval(self) -> None:
+        """
+        Writes the buffered records after _WRITE_INTERVAL_SEC seconds.
+
+        :return:
+        """
+        await asyncio.sleep(_WRITE_INTERVAL_SEC)
+        self._flush_task = None
+        await self._flush_and_log_errors()
+
+    async def _flush_and_log_errors(self) -> None:
+        """
+        Writes the buffered records, logging an error instead of raising it.
+
+        :return:
+        """
+        try:
+            await self.flush()
+        except Exception as e:
+            self._log.exception("Failed to save buffered file records: %s", e)
+
+    async def flush(self) -> None:
+        """
+        Asynchronously saves all buffered file records to the database in a single transaction.
+
+        If the transaction fails, the records are saved one by one instead.
+
+        :return:
+        """
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+        if not self._pending:
+            return
+
+        records, self._pending = self._pending, []
+        try:
+            await self.write_many(records)
+        except Exception as e:
+            self._log.warning("Failed to save %d file records in one transaction, saving them one by one: %s",
+                              len(records), e)
+            await self._write_one_by_one(records)
+            return
+        self._log.info("Saved %d file records.", len(records))
+
+    async def _write_one_by_one(self, records: tp.List[DownloadedFile]) -> None:
+        """
+        Saves file records one per transaction, so that a record rejected by the database does not lose the others.
+
+        Rejected records are logged and dropped. On any other error the records not saved yet are put back
+        into the buffer for the next flush and the error is raised.
+
+        :param records: The DownloadedFile objects to save.
+        :return:
+        """
+        saved = 0
+        for i, record in enumerate(records):
+            try:
+                await self.write(record)
+            except sqlite3.IntegrityError as e:
+                self._log.error("Failed to save record of file %s: %s", record.filename, e)
+                continue
+            except BaseException:
+                self._pending[:0] = records[i:]
+                raise
+            saved += 1
+        self._log.info("Saved %d file records.", saved)
+
+    def _get_message_ids_sync(self, conn: sqlite3.Connection, channel_id: int) -> MessageIdBitmap:
+        """
+        Synchronous worker for retrieving downloaded message IDs for a given channel.
+
+        :param conn: The SQLite database connection.
+        :param channel_id: The channel ID to query for.
+        :return: A bitmap of message IDs.
+        """
+        ids = MessageIdBitmap(self._get_max_message_id_sync(conn, channel_id))
+        for row in conn.execute("SELECT message_id FROM downloaded_videos WHERE channel_id = ?", (channel_id,)):
+            ids.add(int(row["message_id"]))
         return ids
 
-    async def get_files_ids(self, channel_id: int) -> tp.Set[str]:
+    async def get_message_ids(self, channel_id: int) -> MessageIdBitmap:
         """
-        Asynchronously retrieves the set of unique file identifiers for a given channel.
-        This is used to prevent re-downloading existing videos.
+        Asynchronously retrieves the set of IDs of messages whose files were downloaded from a given channel.
+        This is used to prevent re-downloading existing files.
 
         :param channel_id: The channel ID to query for.
-        :return: A set of unique video ID strings.
+        :return: A bitmap of message IDs.
         """
         conn = await self._get_connection()
-        return await asyncio.to_thread(self._get_video_ids_sync, conn, channel_id)
+        return await self._run(self._get_message_ids_sync, conn, channel_id)
+
+    def _get_max_message_id_sync(self, conn: sqlite3.Connection, channel_id: int) -> int:
+        """
+        Synchronous worker for retrieving the greatest downloaded message ID for a given channel.
+
+        :param conn: The SQLite database connection.
+        :param channel_id: The channel ID to query for.
+        :return: The greatest message ID, or 0 if nothing was downloaded from the channel yet.
+        """
+        row = conn.execute(
+            "SELECT MAX(CAST(message_id AS INTEGER)) AS max_id FROM downloaded_videos WHERE channel_id = ?",
+            (channel_id,),
+        ).fetchone()
+        return row["max_id"] or 0
 
     async def _init_schema_if_necessary(self) -> None:
         """
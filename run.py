@@ -1,40 +1,192 @@
-import argparse
 import asyncio
+import contextlib
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+import time
+import typing as tp
 
-import app
 import config
-import repository
 
+if tp.TYPE_CHECKING:
+    import repository
 
-def setup_logging(log_file: str, log_level: int = logging.INFO) -> logging.Logger:
+USAGE = """usage: run.py config_path
+
+Download files from a Telegram channel based on a config file.
+
+positional arguments:
+  config_path  Path to the YAML configuration file."""
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """
+    File handler that writes through a large buffer and flushes it only for records of flush_level and above.
+
+    The remaining buffered records are written on flush or close; logging closes all handlers at interpreter exit.
+    """
+
+    def __init__(self, filename: str, buffer_size: int = 1 << 16, flush_level: int = logging.WARNING):
+        """
+        :param filename: Path to the log file.
+        :param buffer_size: Size of the write buffer in bytes.
+        :param flush_level: Records of this level and above are flushed to the file immediately.
+        """
+        self.buffer_size = buffer_size
+        self.flush_level = flush_level
+        super().__init__(filename)
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size, encoding=self.encoding, errors=self.errors)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.levelno >= self.flush_level:
+            super().emit(record)
+            return
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class LineBufferedStreamHandler(logging.StreamHandler):
+    """
+    Stream handler that does not flush after every record when the stream is line-buffered,
+    since such a stream already writes out each record at its terminating newline.
+    """
+
+    def flush(self) -> None:
+        if not getattr(self.stream, 'line_buffering', False):
+            super().flush()
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that puts records on the queue as they are, leaving all formatting to the listener thread.
+
+    The stock handler merges the message with its arguments and formats tracebacks before queueing a copy of the
+    record, which is only needed when the queue is read by another process.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RestartableQueueListener(logging.handlers.QueueListener):
+    """
+    Queue listener that can be stopped more than once and flushes its handlers when stopped.
+    """
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+class CachedTimeFormatter(logging.Formatter):
+    """
+    Formatter that formats the date and time of asctime once per second instead of for every record.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_second: tp.Optional[int] = None
+        self._cached_time = ""
+
+    def formatTime(self, record: logging.LogRecord, datefmt: tp.Optional[str] = None) -> str:
+        second = int(record.created)
+        if second != self._cached_second:
+            self._cached_time = time.strftime(datefmt or self.default_time_format, self.converter(record.created))
+            self._cached_second = second
+        if datefmt:
+            return self._cached_time
+        return self.default_msec_format % (self._cached_time, record.msecs)
+
+
+def setup_logging(log_file: str, log_level: int = logging.INFO) -> tp.Tuple[logging.Logger, RestartableQueueListener]:
     """
     Configures logging to output to both the console and a specified log file.
 
+    Logging calls only put records on a queue; formatting and writing happen in a background listener thread,
+    so log output does not block the asyncio event loop.
+
     :param log_file: Path to the log file where logs will be written.
     :param log_level: Logging level (e.g., logging.INFO).
-    :return: Logger instance configured with console and file handlers.
+    :return: Logger instance configured with a queue handler, and the started listener writing to console and file
+        handlers. The listener must be stopped before exit to write out the remaining records.
     """
+    # Thread and process details are not in the log format, so records skip collecting them.
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    # Errors inside handlers are dropped instead of printing a traceback for every failed record.
+    logging.raiseExceptions = False
+
     log = logging.getLogger()
     log.setLevel(log_level)
 
-    log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # Handlers of a previous call are replaced, otherwise every record would be written once per call.
+    for handler in log.handlers[:]:
+        log.removeHandler(handler)
+        listener = getattr(handler, 'listener', None)
+        if listener is not None:
+            listener.stop()
+            for listener_handler in listener.handlers:
+                listener_handler.close()
+        handler.close()
 
-    console_handler = logging.StreamHandler(sys.stdout)
+    log_formatter = CachedTimeFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(line_buffering=True)
+    console_handler = LineBufferedStreamHandler(sys.stdout)
     console_handler.setFormatter(log_formatter)
-    log.addHandler(console_handler)
+    console_handler.setLevel(log_level)
+    handlers: tp.List[logging.Handler] = [console_handler]
 
+    file_handler_error = None
     if log_file:
         try:
-            file_handler = logging.FileHandler(log_file)
+            file_handler = BufferedFileHandler(log_file)
             file_handler.setFormatter(log_formatter)
-            log.addHandler(file_handler)
+            file_handler.setLevel(log_level)
+            handlers.append(file_handler)
         except Exception as e:
-            log.error(f"Failed to create file handler for logging at {log_file}: {e}")
+            file_handler_error = e
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    queue_handler.setLevel(log_level)
+    log.addHandler(queue_handler)
+    listener = RestartableQueueListener(log_queue, *handlers, respect_handler_level=True)
+    queue_handler.listener = listener
+    listener.start()
 
-    return log
+    if file_handler_error is not None:
+        log.error("Failed to create file handler for logging at %s: %s", log_file, file_handler_error)
+
+    return log, listener
+
+
+async def _flush_repository(repo: 'repository.SqliteFileDownloadHistoryRepository', log: logging.Logger) -> None:
+    """
+    Saves the file records buffered by the repository, logging an error instead of raising it.
+
+    :param repo: The download history repository.
+    :param log: Logger to report the error to.
+    :return:
+    """
+    try:
+        await repo.flush()
+    except Exception:
+        log.exception("failed to save buffered file records")
 
 
 async def main() -> None:
@@ -42,45 +194,90 @@ async def main() -> None:
     Main function to parse arguments, set up services, and run the download application.
     :return:
     """
-    parser = argparse.ArgumentParser(
-        description="Download files from a Telegram channel based on a config file."
-    )
-    parser.add_argument(
-        "config_path",
-        help="Path to the YAML configuration file."
-    )
-    args = parser.parse_args()
+    # The only argument is the config path, which does not need argparse.
+    if len(sys.argv) == 2 and sys.argv[1] in ("-h", "--help"):
+        print(USAGE)
+        sys.exit(0)
+    if len(sys.argv) != 2:
+        print(USAGE, file=sys.stderr)
+        sys.exit(2)
+    config_path = sys.argv[1]
 
     try:
-        cfg = config.Config.load_from_yaml(args.config_path)
+        cfg = config.Config.load_from_yaml_cached(config_path)
     except FileNotFoundError:
-        print(f"Error: Configuration file not found at '{args.config_path}'", file=sys.stderr)
+        print(f"Error: Configuration file not found at '{config_path}'", file=sys.stderr)
         sys.exit(1)
     except Exception as e:
-        print(f"Error loading or parsing config file '{args.config_path}': {e}", file=sys.stderr)
+        print(f"Error loading or parsing config file '{config_path}': {e}", file=sys.stderr)
         sys.exit(1)
 
-    log = setup_logging(cfg.app.log_file)
+    # Imported only once the config is loaded, so --help and config errors do not pay for importing Telethon.
+    import app
+    import repository
 
-    repo = None
-    try:
-        os.makedirs(cfg.storage.video_dir, exist_ok=True)
-        log.info(f"Videos download directory set to: '{cfg.storage.video_dir}'")
+    video_dir = cfg.storage.video_dir
+    audio_dir = cfg.storage.audio_dir
+    sqlite_file = cfg.storage.sqlite_file
+    log_file = cfg.app.log_file
+
+    log, log_listener = setup_logging(log_file)
 
-        os.makedirs(cfg.storage.audio_dir, exist_ok=True)
-        log.info(f"Audios download directory set to: '{cfg.storage.audio_dir}'")
+    async with contextlib.AsyncExitStack() as stack:
+        # Teardown runs in reverse order: buffered records are saved, the database is closed, then logs are written out.
+        stack.callback(log_listener.stop)
+        try:
+            repo = repository.SqliteFileDownloadHistoryRepository(sqlite_file)
+            stack.push_async_callback(repo.close_conn)
+            stack.push_async_callback(_flush_repository, repo, log)
 
-        repo = repository.SqliteFileDownloadHistoryRepository(cfg.storage.sqlite_file)
-        log.info("Initialized database repository.")
+            # The download directories are created together, but before the database is opened,
+            # since the database file may be located in one of them.
+            await asyncio.gather(
+                asyncio.to_thread(os.makedirs, video_dir, exist_ok=True),
+                asyncio.to_thread(os.makedirs, audio_dir, exist_ok=True),
+            )
+            log.info("Videos download directory set to: '%s'", video_dir)
+            log.info("Audios download directory set to: '%s'", audio_dir)
+            await repo.open_conn()
+            log.info("Initialized database repository.")
 
-        downloader = app.DownloadFilesApp(repo, cfg, log)
-        await downloader.download_and_save()
-    except Exception:
-        log.exception(f"critical error occurred in the application")
+            downloader = app.DownloadFilesApp(repo, cfg, log)
+            await downloader.download_and_save()
+        except Exception:
+            log.exception("critical error occurred in the application")
+
+
+def run() -> None:
+    """
+    Runs main in a new event loop, using uvloop when it is installed.
+
+    Unlike asyncio.run, a clean exit skips cancelling leftover tasks, since main awaits everything it starts;
+    they are only cancelled when main fails.
+    :return:
+    """
+    try:
+        import uvloop
+        loop = uvloop.new_event_loop()
+    except ImportError:
+        loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(main())
+    except BaseException:
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        raise
     finally:
-        if repo and hasattr(repo, 'close_conn'):
-            await repo.close_conn()
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()